@@ -1,7 +1,16 @@
-import os
+import itertools
+import re
 import sys
 
-from object import GitObject, object_find, object_hash, object_read
+from object import (
+    GitObject,
+    commit_parents,
+    commit_walk,
+    object_find,
+    object_hash,
+    object_read,
+    tree_walk,
+)
 from repository import GitRepository, repo_create, repo_find
 
 
@@ -39,84 +48,163 @@ def cmd_init(args):
 
 
 def cmd_log(args):
-    """CLI function to display commit history as graphviz data."""
+    """CLI function to display commit history, as text or graphviz data."""
     repo = repo_find()
+    sha = object_find(repo, args.commit)
+    commits = commit_walk(repo, sha, topo_order=args.topo_order)
+    # Like git, a negative count means no limit.
+    if args.max_count is not None and args.max_count >= 0:
+        commits = itertools.islice(commits, args.max_count)
+
+    if args.oneline:
+        log_text(commits, "%h %s")
+    elif args.format is not None:
+        log_text(commits, args.format)
+    else:
+        log_graphviz(commits)
+
 
+def log_graphviz(commits):
+    """Print the graphviz representation of a sequence of (sha, commit)"""
     print("digraph wyaglog{")
     print("  node[shape=rect]")
-    log_graphviz(repo, object_find(repo, args.commit), set())
-    print("}")
 
+    for sha, commit in commits:
+        message = log_subject(commit)
+        message = message.replace("\\", "\\\\")
+        message = message.replace('"', '\\"')
 
-def log_graphviz(repo: GitRepository, sha: str, already_seen: set):
-    """Recursively print the graphviz representation of the history from a commit"""
-    if sha in already_seen:
-        return
-    already_seen.add(sha)
+        print(f'  c_{sha} [label="{sha[:8]}: {message}"]')
+        for parent in commit_parents(commit):
+            print(f"  c_{sha} -> c_{parent};")
 
-    commit = object_read(repo, sha)
-    short_hash = sha[:8]
-    message = commit.kvlm[None].decode().strip()
-    message = message.replace("\\", "\\\\")
-    message = message.replace('"', '\\"')
+    print("}")
 
-    # Keep only the first line.
-    if "\n" in message:
-        message = message[: message.index("\n")]
 
-    print(f'  c_{sha} [label="{short_hash}: {message}"]')
-    assert commit.fmt == b"commit"
+def log_text(commits, fmt: str, batch_size: int = 64):
+    """Print a sequence of (sha, commit), one line each, following fmt."""
+    out = sys.stdout.buffer
+    lines = []
 
-    # Base case : initial commit
-    if b"parent" not in commit.kvlm.keys():
-        return
+    for sha, commit in commits:
+        lines.append(log_format(sha, commit, fmt).encode() + b"\n")
 
-    parents = commit.kvlm[b"parent"]
+        # Write in small batches, so that long walks still start output early.
+        if len(lines) >= batch_size:
+            out.write(b"".join(lines))
+            out.flush()
+            lines = []
 
-    if type(parents) is not list:
-        parents = [parents]
+    out.write(b"".join(lines))
+    out.flush()
 
-    for parent in parents:
-        parent = parent.decode("ascii")
-        print(f"  c_{sha} -> c_{parent};")
-        log_graphviz(repo, parent, already_seen)
+
+def log_subject(commit) -> str:
+    """Return the first line of a commit message."""
+    message = commit.kvlm[None].decode().strip()
+
+    # Keep only the first line.
+    if "\n" in message:
+        message = message[: message.index("\n")]
+    return message
+
+
+def log_format(sha: str, commit, fmt: str) -> str:
+    """
+    Expand a log format string for a commit.
+
+    Supported placeholders are %H (sha), %h (short sha), %P (parent shas),
+    %s (subject), %an/%ae/%at (author name, email, timestamp),
+    %cn/%ce/%ct (same for committer), %n (newline) and %%.
+    """
+
+    def person(key: bytes) -> tuple[str, str, str]:
+        value = commit.kvlm.get(key, b"")
+        if type(value) is list:
+            value = value[0]
+        # The value is "<name> <<email>> <timestamp> <timezone>"
+        fields = re.match(rb"(.*?) ?<(.*)> (\d+) ", value)
+        if fields is None:
+            return "", "", ""
+        return tuple(field.decode() for field in fields.groups())
+
+    def expand(placeholder: re.Match) -> str:
+        match placeholder.group(0):
+            case "%H":
+                return sha
+            case "%h":
+                return sha[:7]
+            case "%P":
+                return " ".join(commit_parents(commit))
+            case "%s":
+                return log_subject(commit)
+            case "%an":
+                return person(b"author")[0]
+            case "%ae":
+                return person(b"author")[1]
+            case "%at":
+                return person(b"author")[2]
+            case "%cn":
+                return person(b"committer")[0]
+            case "%ce":
+                return person(b"committer")[1]
+            case "%ct":
+                return person(b"committer")[2]
+            case "%n":
+                return "\n"
+            case "%%":
+                return "%"
+
+    return re.sub(r"%[ac][net]|%[HhPsn%]", expand, fmt)
 
 
 def cmd_ls_files(args): ...
 def cmd_ls_tree(args):
+    """CLI function to list the contents of a tree object."""
     repo = repo_find()
-    ls_tree(repo, args.tree, args.recursive)
-
-
-def ls_tree(repo: GitRepository, ref: str, recursive: bool = None, prefix: str = ""):
+    ls_tree(
+        repo,
+        args.tree,
+        args.recursive,
+        paths=args.path,
+        name_only=args.name_only,
+        null_terminated=args.null_terminated,
+    )
+
+
+def ls_tree(
+    repo: GitRepository,
+    ref: str,
+    recursive: bool = False,
+    paths: list[str] | None = None,
+    name_only: bool = False,
+    null_terminated: bool = False,
+    batch_size: int = 4096,
+):
+    """Print the entries of a tree, optionally limited to some path prefixes."""
     sha = object_find(repo, ref, fmt=b"tree")
-    obj = object_read(repo, sha)
+    terminator = b"\x00" if null_terminated else b"\n"
+    out = sys.stdout.buffer
+    lines = []
 
-    for item in obj.items:
-        if len(item.mode) == 5:
-            item_raw_type = item.mode[:1]
-        else:
-            item_raw_type = item.mode[:2]
-
-        match item_raw_type:
-            case b"04":
-                item_type = "tree"
-            case b"10":
-                item_type = "blob"  # A regular file
-            case b"12":
-                item_type = "blob"  # A symlink. Blob contents is link target
-            case b"16":
-                item_type = "commit"  # A submodule
-            case _:
-                raise Exception(f"Unknown tree leaf mode {item_raw_type}")
-        
-        # If this is a leaf
-        if not (recursive and item_type=='tree'):
-            print(f"{"0"* (6-len(item.mode)) + item.mode.decode("ascii")} "
-                  + f"{item_type} {item.sha}\t{os.path.join(prefix, item.path)}")
-        
+    for item, path, item_type in tree_walk(repo, sha, recursive, paths):
+        if name_only:
+            line = path.encode()
         else:
-            ls_tree(repo, item.sha, recursive, os.path.join(prefix, item.path))
+            mode = item.mode.strip().rjust(6, b"0")
+            line = mode + f" {item_type} {item.sha}\t{path}".encode()
+        lines.append(line)
+
+        # Write in batches rather than once per entry.
+        if len(lines) >= batch_size:
+            lines.append(b"")
+            out.write(terminator.join(lines))
+            lines = []
+
+    if lines:
+        lines.append(b"")
+        out.write(terminator.join(lines))
+    out.flush()
 
 
 def cmd_rev_parse(args): ...
@@ -55,6 +55,33 @@ argsp.add_argument(
 
 
 argsp = argsubparsers.add_parser("log", help="Display commit history.")
+argsp.add_argument(
+    "-n",
+    metavar="number",
+    dest="max_count",
+    type=int,
+    default=None,
+    help="Limit the number of commits to output (negative for no limit).",
+)
+argsp.add_argument(
+    "--format",
+    metavar="format",
+    dest="format",
+    default=None,
+    help="Print one line per commit following a format string, instead of graphviz data.",
+)
+argsp.add_argument(
+    "--oneline",
+    dest="oneline",
+    action="store_true",
+    help='Shorthand for --format "%%h %%s".',
+)
+argsp.add_argument(
+    "--topo-order",
+    dest="topo_order",
+    action="store_true",
+    help="Show no parents before all of its children are shown.",
+)
 argsp.add_argument(
     "commit",
     default="HEAD",
@@ -70,7 +97,24 @@ argsp.add_argument(
     action="store_true",
     help="Recurse into sub-trees.",
 )
+argsp.add_argument(
+    "-z",
+    dest="null_terminated",
+    action="store_true",
+    help="Terminate entries with NUL instead of newline.",
+)
+argsp.add_argument(
+    "--name-only",
+    dest="name_only",
+    action="store_true",
+    help="List only the paths of the entries.",
+)
 argsp.add_argument(
     "tree",
     help="A tree-like object.",
 )
+argsp.add_argument(
+    "path",
+    nargs="*",
+    help="Only list entries matching these path prefixes.",
+)
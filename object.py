@@ -1,9 +1,12 @@
 import collections
 import hashlib
+import heapq
 import os
 import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
 
-from repository import GitRepository, repo_file
+from repository import GitRepository, repo_dir_forget, repo_file
 
 
 class GitObject(object):
@@ -145,7 +148,15 @@ def object_write(obj: GitObject, repo: GitRepository | None = None) -> str:
         path = repo_file(repo, "objects", sha[:2], sha[2:], mkdir=True)
 
         if not os.path.exists(path):
-            with open(path, "wb") as file:
+            try:
+                file = open(path, "wb")
+            except FileNotFoundError:
+                # The fanout directory was removed since it was last seen.
+                repo_dir_forget(os.path.dirname(path))
+                path = repo_file(repo, "objects", sha[:2], sha[2:], mkdir=True)
+                file = open(path, "wb")
+
+            with file:
                 # Compress and write
                 file.write(zlib.compress(raw_object))
 
@@ -321,3 +332,240 @@ def tree_serialize(tree: GitTree) -> bytes:
         output += sha.to_bytes(20, byteorder="big")
 
     return output
+
+
+def tree_leaf_type(leaf: GitTreeLeaf) -> str:
+    """Return the type of the object a tree leaf points to, from its mode."""
+    match leaf.mode.strip().rjust(6, b"0")[:2]:
+        case b"04":
+            return "tree"
+        case b"10":
+            return "blob"  # A regular file
+        case b"12":
+            return "blob"  # A symlink. Blob contents is link target
+        case b"16":
+            return "commit"  # A submodule
+        case _:
+            raise Exception(f"Unknown tree leaf mode {leaf.mode.decode('ascii')}")
+
+
+def tree_path_selected(path: str, prefixes: list[str] | None) -> tuple[bool, bool]:
+    """
+    Match a tree path against path prefixes.
+
+    Return (inside, ancestor): inside if path is one of the prefixes or lies
+    below one, ancestor if one of the prefixes lies below path.
+    A prefix ending with a slash only selects the directory contents.
+    """
+    if not prefixes:
+        return True, False
+
+    inside = ancestor = False
+    for prefix in prefixes:
+        name = prefix.rstrip("/")
+        if path.startswith(name + "/") or path == prefix:
+            inside = True
+        if prefix.startswith(path + "/"):
+            ancestor = True
+    return inside, ancestor
+
+
+def tree_path_normalize(path: str) -> str | None:
+    """
+    Normalize a path prefix relative to the top of a tree, keeping a trailing
+    slash. Return None if the prefix selects the whole tree.
+    """
+    normalized = os.path.normpath(path)
+    if normalized == ".":
+        return None
+    if os.path.isabs(normalized) or normalized.split(os.sep)[0] == "..":
+        raise Exception(f"Path outside of the tree: {path}")
+
+    normalized = normalized.replace(os.sep, "/")
+    if path.endswith("/"):
+        normalized += "/"
+    return normalized
+
+
+def tree_walk(
+    repo: GitRepository,
+    sha: str,
+    recursive: bool = True,
+    prefixes: list[str] | None = None,
+    workers: int = 8,
+) -> Iterator[tuple[GitTreeLeaf, str, str]]:
+    """
+    Iteratively walk a tree, yielding (leaf, path, type) in tree order.
+
+    Subtrees are entered if recursive, or if they lead to one of the path
+    prefixes; subtrees outside of the prefixes are never read. The next few
+    subtrees the walk will enter, nearest first, are read ahead on a thread
+    pool while the current tree is being listed.
+    """
+    if prefixes:
+        prefixes = [tree_path_normalize(prefix) for prefix in prefixes]
+        if None in prefixes:
+            prefixes = None
+
+    def read_items(tree_sha: str) -> list[GitTreeLeaf]:
+        tree = object_read(repo, tree_sha)
+        if tree is None or tree.fmt != b"tree":
+            raise Exception(f"Not a tree object {tree_sha}")
+        return tree.items
+
+    def schedule(items: list[GitTreeLeaf], base: str) -> list[list]:
+        # Decide for every leaf of a tree whether it is shown and/or entered.
+        # The last field will hold the read-ahead of an entered subtree.
+        entries = []
+        for leaf in items:
+            path = base + leaf.path
+            leaf_type = tree_leaf_type(leaf)
+            inside, ancestor = tree_path_selected(path, prefixes)
+
+            if leaf_type == "tree" and (ancestor or (inside and recursive)):
+                entries.append([leaf, path, leaf_type, True, None])
+            elif inside:
+                entries.append([leaf, path, leaf_type, False, None])
+        return entries
+
+    def read_ahead():
+        # Start reading the subtrees that will be entered next: those left in
+        # the innermost tree first, then in the trees containing it.
+        nonlocal pending
+        for frame in reversed(stack):
+            entries = frame[0]
+            while pending < max_pending and frame[2] < len(entries):
+                entry = entries[frame[2]]
+                frame[2] += 1
+                if entry[3]:
+                    entry[4] = executor.submit(read_items, entry[0].sha)
+                    pending += 1
+            if pending >= max_pending:
+                return
+
+    max_pending = 2 * workers
+    pending = 0
+
+    # Abandoned read-aheads are cancelled if the caller stops early.
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        # Each frame is [entries, next entry to list, next entry to read ahead]
+        stack = [[schedule(read_items(sha), ""), 0, 0]]
+        read_ahead()
+
+        while stack:
+            frame = stack[-1]
+            entries, position = frame[0], frame[1]
+            if position == len(entries):
+                stack.pop()
+                continue
+
+            frame[1] = position + 1
+            frame[2] = max(frame[2], frame[1])
+            leaf, path, leaf_type, enter, subtree = entries[position]
+
+            if not enter:
+                yield leaf, path, leaf_type
+                continue
+
+            if subtree is None:
+                items = read_items(leaf.sha)
+            else:
+                items = subtree.result()
+                entries[position][4] = None
+                pending -= 1
+
+            stack.append([schedule(items, path + "/"), 0, 0])
+            read_ahead()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def commit_parents(commit: GitCommit) -> list[str]:
+    """Return the parent shas of a commit, in order."""
+    parents = commit.kvlm.get(b"parent", [])
+
+    if type(parents) is not list:
+        parents = [parents]
+
+    return [parent.decode("ascii") for parent in parents]
+
+
+def commit_time(commit: GitCommit) -> int:
+    """Return the committer timestamp of a commit, or 0 if it has none."""
+    committer = commit.kvlm.get(b"committer", b"")
+    if type(committer) is list:
+        committer = committer[0]
+
+    # The value ends with "<timestamp> <timezone>"
+    fields = committer.rsplit(b" ", 2)
+    if len(fields) < 3 or not fields[1].isdigit():
+        return 0
+    return int(fields[1])
+
+
+def commit_walk(
+    repo: GitRepository, sha: str, topo_order: bool = False
+) -> Iterator[tuple[str, GitCommit]]:
+    """
+    Iteratively walk the history from a commit, yielding (sha, commit).
+
+    By default, commits come out newest first by committer date, read lazily
+    from a priority queue, so that the caller can stop the walk at any time.
+    With topo_order, no commit is shown before all of its children, and lines
+    of history are not interleaved. This needs the whole history to be read
+    first to count the children of every commit.
+    """
+
+    def read_commit(commit_sha: str) -> GitCommit:
+        commit = object_read(repo, commit_sha)
+        if commit is None or commit.fmt != b"commit":
+            raise Exception(f"Not a commit object {commit_sha}")
+        return commit
+
+    if not topo_order:
+        # The counter keeps the heap stable between commits with the same date.
+        commit = read_commit(sha)
+        queue = [(-commit_time(commit), 0, sha, commit)]
+        seen = {sha}
+        counter = 1
+
+        while queue:
+            _, _, sha, commit = heapq.heappop(queue)
+            yield sha, commit
+
+            for parent in commit_parents(commit):
+                if parent in seen:
+                    continue
+                seen.add(parent)
+                parent_commit = read_commit(parent)
+                heapq.heappush(
+                    queue, (-commit_time(parent_commit), counter, parent, parent_commit)
+                )
+                counter += 1
+        return
+
+    # First pass: read every reachable commit and count its children.
+    commits = {sha: read_commit(sha)}
+    children_count = {sha: 0}
+    pending = [sha]
+    while pending:
+        for parent in commit_parents(commits[pending.pop()]):
+            if parent not in commits:
+                commits[parent] = read_commit(parent)
+                children_count[parent] = 0
+                pending.append(parent)
+            children_count[parent] += 1
+
+    # Second pass: emit a commit once all its children have been emitted,
+    # following the most recently freed line of history first, like git.
+    stack = [sha]
+    while stack:
+        sha = stack.pop()
+        commit = commits[sha]
+        yield sha, commit
+
+        for parent in commit_parents(commit):
+            children_count[parent] -= 1
+            if children_count[parent] == 0:
+                stack.append(parent)
@@ -2,29 +2,81 @@ import configparser
 import os
 from pathlib import Path
 
+# Paths shared by all the worktrees of a repository, found in the common gitdir,
+# and the exceptions below them that belong to each worktree, as in git.
+# Any other path belongs to the worktree (HEAD, index, ORIG_HEAD...).
+COMMON_PATHS = {
+    "branches",
+    "common",
+    "config",
+    "gc.pid",
+    "hooks",
+    "info",
+    "logs",
+    "lost-found",
+    "objects",
+    "packed-refs",
+    "refs",
+    "remotes",
+    "rr-cache",
+    "shallow",
+    "svn",
+    "worktrees",
+}
+WORKTREE_PATHS = {
+    "info/sparse-checkout",
+    "logs/HEAD",
+    "logs/refs/bisect",
+    "logs/refs/rewritten",
+    "logs/refs/worktree",
+    "refs/bisect",
+    "refs/rewritten",
+    "refs/worktree",
+}
+
+# Per-process caches:
+# - config files, keyed by path, along with the mtime and size they were read at;
+# - repositories found by repo_find, keyed by start path and environment, along
+#   with the mtime of the start directory (None when given by GIT_DIR);
+# - absolute paths of directories repo_dir(mkdir=True) already made sure exist.
+_config_cache: dict[str, tuple[tuple[int, int], configparser.ConfigParser]] = {}
+_repo_cache: dict[tuple, tuple[int | None, "GitRepository"]] = {}
+_known_dirs: set[str] = set()
+
 
 class GitRepository(object):
     """A git repository"""
 
     worktree = None
     gitdir = None
+    commondir = None
     conf_parser = None
 
-    def __init__(self, path: str | Path, force: bool = False) -> None:
+    def __init__(
+        self, path: str | Path, force: bool = False, gitdir: str | Path | None = None
+    ) -> None:
         self.worktree = path
-        self.gitdir = os.path.join(path, ".git")
+        self.gitdir = gitdir if gitdir is not None else os.path.join(path, ".git")
 
         if not (force or os.path.isdir(self.gitdir)):
-            raise Exception(f"Not a Git repository : {path}")
+            raise Exception(f"Not a Git repository : {self.gitdir}")
+
+        # Linked worktrees share objects, refs and config with a common gitdir.
+        self.commondir = self.gitdir
+        commondir_file = os.path.join(self.gitdir, "commondir")
+        if os.path.isfile(commondir_file):
+            with open(commondir_file) as file:
+                self.commondir = os.path.normpath(
+                    os.path.join(self.gitdir, file.read().strip())
+                )
 
         # Read configuration file in .git/config
-        self.conf_parser = configparser.ConfigParser()
-        config_file = repo_file(self, "config")
+        self.conf_parser = repo_config_read(os.path.join(self.commondir, "config"))
 
-        if config_file and os.path.exists(config_file):
-            self.conf_parser.read([config_file])
-        elif not force:
-            raise Exception("Configuration file missing")
+        if self.conf_parser is None:
+            if not force:
+                raise Exception("Configuration file missing")
+            self.conf_parser = configparser.ConfigParser()
 
         if not force:
             version = int(self.conf_parser.get("core", "repositoryformatversion"))
@@ -32,8 +84,44 @@ class GitRepository(object):
                 raise Exception(f"Unsupported repositoryformatversion {version}")
 
 
+def repo_config_read(path: str) -> configparser.ConfigParser | None:
+    """
+    Read a configuration file, or return None if it doesn't exist.
+
+    Parsed files are cached until their mtime or size changes, so the returned
+    parser is shared and must not be modified.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _config_cache.pop(path, None)
+        return None
+
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _config_cache.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    conf_parser = configparser.ConfigParser()
+    conf_parser.read([path])
+    _config_cache[path] = (version, conf_parser)
+    return conf_parser
+
+
 def repo_path(repo: GitRepository, *path: str | Path) -> str:
-    """Compute path under repo's gitdir."""
+    """Compute path under repo's gitdir, or its common gitdir for shared files."""
+    # Only linked worktrees have a separate common gitdir.
+    if repo.commondir == repo.gitdir:
+        return os.path.join(repo.gitdir, *path)
+
+    relative = "/".join(str(part) for part in path)
+
+    for worktree_path in WORKTREE_PATHS:
+        if relative == worktree_path or relative.startswith(worktree_path + "/"):
+            return os.path.join(repo.gitdir, *path)
+
+    if relative.split("/", 1)[0] in COMMON_PATHS:
+        return os.path.join(repo.commondir, *path)
     return os.path.join(repo.gitdir, *path)
 
 
@@ -52,21 +140,45 @@ def repo_file(
 
 
 def repo_dir(repo: GitRepository, *path: str | Path, mkdir: bool = False) -> str | None:
-    """Compute path under repo's gitdir, and mkdir *path if absent and mkdir"""
+    """
+    Compute path under repo's gitdir, and mkdir *path if absent and mkdir
+
+    With mkdir, directories already checked or created are remembered, so that
+    writing many objects doesn't check the same fanout directories again. Call
+    repo_dir_forget if one of them may have been removed since.
+    """
     path = repo_path(repo, *path)
 
+    if mkdir and os.path.abspath(path) in _known_dirs:
+        return path
+
     if os.path.exists(path):
         if os.path.isdir(path):
+            if mkdir:
+                _known_dirs.add(os.path.abspath(path))
             return path
         else:
             raise Exception(f"Not a directory {path}")
 
     if mkdir:
         os.makedirs(path)
+        _known_dirs.add(os.path.abspath(path))
         return path
     return None
 
 
+def repo_dir_forget(path: str | Path) -> None:
+    """Forget that path and the directories below it are known to exist."""
+    path = os.path.abspath(path)
+    _known_dirs.difference_update(
+        [
+            known
+            for known in _known_dirs
+            if known == path or known.startswith(path + os.sep)
+        ]
+    )
+
+
 def repo_create(path: str | Path) -> GitRepository:
     """Create a new git repository at path"""
     # Make sure we are not already in a repository
@@ -87,6 +199,11 @@ def repo_create(path: str | Path) -> GitRepository:
     else:
         os.makedirs(repo.worktree)
 
+    # A previous repository at this path may have been removed, and the new
+    # one may be found instead of a repository repo_find already returned.
+    repo_dir_forget(repo.gitdir)
+    _repo_cache.clear()
+
     assert repo_dir(repo, "branches", mkdir=True)
     assert repo_dir(repo, "objects", mkdir=True)
     assert repo_dir(repo, "refs", "tags", mkdir=True)
@@ -124,22 +241,93 @@ def repo_find(path: str | Path = ".", required: bool = True) -> GitRepository |
     """
     Find the root of the current repository.
     Fails if required and not in a repository.
-    """
-    real_path = os.path.realpath(path)
-
-    if os.path.isdir(os.path.join(real_path, ".git")):
-        return GitRepository(real_path)
 
-    # If there is no .git file, recurse in parent
-    parent = os.path.realpath(os.path.join(real_path, ".."))
+    Like git, GIT_DIR and GIT_WORK_TREE override the discovery, the search
+    doesn't go up into GIT_CEILING_DIRECTORIES, and a .git file pointing to
+    the actual gitdir ("gitdir: <path>") is followed.
+    """
+    env_gitdir = os.environ.get("GIT_DIR")
+    env_worktree = os.environ.get("GIT_WORK_TREE")
+    env_ceilings = os.environ.get("GIT_CEILING_DIRECTORIES")
+
+    # Resolving symlinks costs a call per path component, so only do it once
+    # the cache missed.
+    start = os.path.abspath(path)
+    key = (start, env_gitdir, env_worktree, env_ceilings)
+
+    # A cached repository is reused while its config file and the start
+    # directory are unchanged. A .git appearing in a directory between the
+    # start and the repository is only noticed if created by repo_create.
+    cached = _repo_cache.get(key)
+    if cached is not None:
+        start_mtime, repo = cached
+        config = repo_config_read(os.path.join(repo.commondir, "config"))
+        if config is repo.conf_parser and (
+            start_mtime is None or start_mtime == repo_mtime(start)
+        ):
+            return repo
+
+    real_path = os.path.realpath(start)
+    if env_gitdir:
+        start_mtime, worktree = None, real_path
+        gitdir = os.path.abspath(env_gitdir)
+    else:
+        start_mtime = repo_mtime(start)
+        worktree, gitdir = repo_discover(real_path, env_ceilings)
 
-    if parent == real_path:
-        # Base case : os.path.join("/", "..") == "/":
-        # If parent==path, then path is root.
+    if gitdir is None:
         if required:
             raise Exception("Not a git directory.")
-        else:
-            return None
+        return None
+
+    if env_worktree:
+        worktree = os.path.realpath(env_worktree)
 
-    # Recursion step
-    return repo_find(parent, required)
+    repo = GitRepository(worktree, gitdir=gitdir)
+    if env_gitdir or start_mtime is not None:
+        _repo_cache[key] = (start_mtime, repo)
+    return repo
+
+
+def repo_mtime(path: str) -> int | None:
+    """Return the mtime of path in nanoseconds, or None if it doesn't exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def repo_discover(
+    real_path: str, ceilings: str | None = None
+) -> tuple[str, str] | tuple[None, None]:
+    """
+    Walk up from real_path to find a gitdir.
+
+    Return (worktree, gitdir), or (None, None) if there is no repository
+    before reaching the root or one of the ceiling directories.
+    """
+    ceiling_dirs = set()
+    for ceiling in (ceilings or "").split(os.pathsep):
+        if os.path.isabs(ceiling):
+            ceiling_dirs.add(os.path.realpath(ceiling))
+
+    current = real_path
+    while True:
+        dot_git = os.path.join(current, ".git")
+
+        if os.path.isdir(dot_git):
+            return current, dot_git
+
+        if os.path.isfile(dot_git):
+            with open(dot_git) as file:
+                content = file.read().strip()
+            if not content.startswith("gitdir: "):
+                raise Exception(f"Invalid gitfile format: {dot_git}")
+            gitdir = os.path.join(current, content[len("gitdir: ") :])
+            return current, os.path.normpath(gitdir)
+
+        # os.path.dirname("/") == "/": if parent == current, current is root.
+        parent = os.path.dirname(current)
+        if parent == current or parent in ceiling_dirs:
+            return None, None
+        current = parent